@@ -22,13 +22,19 @@ Main application
 """
 
 import logging as _logging
-import multiprocessing as _mp
+import threading as _threading
 
 import fortworth as _fortworth
 import wheedle.artifact_poller as _apoller
 import wheedle.commit_poller as _cpoller
 import wheedle.configuration as _config
 import wheedle.errors as _errors
+import wheedle.gh_api as _gh_api
+
+
+
+# Name of GitHub ETag cache file in the data directory
+ETAG_CACHE_FILE_NAME = 'etag-cache.sqlite'
 
 
 
@@ -39,56 +45,64 @@ class Application:
     def __init__(self, home, data_dir=None, config_file=None):
         self._home = home
         self._log = _logging.getLogger(self.__class__.__name__)
-        self._process_list = []
+        self._thread_list = []
         config_file = config_file if config_file is not None else _fortworth.join(home,
                                                                                   'wheedle.conf')
         self._config = _config.Configuration(config_file, data_dir)
         try:
-            _logging.basicConfig(level=self._config['Logging']['default_log_level'],
+            _logging.basicConfig(level=self._config['Logging']['default_log_level'].upper(),
                                  format='%(asctime)s  %(name)s - %(levelname)s: %(message)s',
                                  datefmt='%Y-%m-%d %H:%M:%S %Z')
         except ValueError as err:
             raise _errors.ConfigFileError(self._config.config_file_name(), 'Logging', err)
+        # Thread and process details are not in the log format, so do not collect them per record
+        _logging.logThreads = False
+        _logging.logProcesses = False
+        _logging.logMultiprocessing = False
         self._log.info('Data directory: %s', self._config.data_dir())
+        _gh_api.ETAG_CACHE.open(_fortworth.join(self._config.data_dir(), ETAG_CACHE_FILE_NAME))
 
     def run(self):
         """ Run the application. This starts each of the configured artifact and commit pollers """
         try:
             self._start_pollers(self._config.poller_names())
 
-            # Wait for processes to terminate
-            for process in self._process_list:
-                process.join()
+            # Wait for poller threads to terminate
+            for thread in self._thread_list:
+                thread.join()
         except _errors.PollerError as err:
             self._log.error(err)
             _fortworth.exit(1)
         except KeyboardInterrupt:
             print(' KeyboardInterrupt')
+        finally:
+            # Commit any ETag cache changes not yet written
+            _gh_api.ETAG_CACHE.close()
         self._log.info('exit')
 
     def _start_pollers(self, poller_name_list):
         for poller_name in poller_name_list:
             ap_event = None
             if self._config.has_commit_poller(poller_name):
-                ap_event = _mp.Event()
+                ap_event = _threading.Event()
                 self._start_commit_poller(poller_name, ap_event)
             self._start_artifact_poller(poller_name, ap_event)
 
     def _start_artifact_poller(self, name, ap_event):
         """ Start the named artifact poller """
-        artifact_poller_process = _mp.Process(target=_apoller.ArtifactPoller.run,
-                                              args=(self._config, name, ap_event),
-                                              name=name + '-AP')
-        artifact_poller_process.start()
-        self._process_list.append(artifact_poller_process)
+        artifact_poller_thread = _threading.Thread(target=_apoller.ArtifactPoller.run,
+                                                   args=(self._config, name, ap_event),
+                                                   name=name + '-AP', daemon=True)
+        artifact_poller_thread.start()
+        self._thread_list.append(artifact_poller_thread)
 
     def _start_commit_poller(self, name, ap_event):
         """ Start the named commit poller """
-        commit_poller_process = _mp.Process(target=_cpoller.CommitPoller.run,
-                                            args=(self._config, name, ap_event),
-                                            name=name + '-CP')
-        commit_poller_process.start()
-        self._process_list.append(commit_poller_process)
+        commit_poller_thread = _threading.Thread(target=_cpoller.CommitPoller.run,
+                                                 args=(self._config, name, ap_event),
+                                                 name=name + '-CP', daemon=True)
+        commit_poller_thread.start()
+        self._thread_list.append(commit_poller_thread)
 
 
 
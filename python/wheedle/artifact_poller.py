@@ -24,12 +24,17 @@ checking for new artifacts. If found, the poller updates Stagger and sends the a
 The artifact ids are saved in a local file data/artifact_id.json.
 """
 
+import concurrent.futures as _futures
 import fnmatch as _fnmatch
 import json as _json
 import logging as _logging
 import os as _os
-import sched as _sched
+import queue as _queue
+import re as _re
 import shutil as _shutil
+import stat as _stat
+import tempfile as _tempfile
+import threading as _threading
 import time as _time
 import zipfile as _zipfile
 
@@ -44,16 +49,34 @@ import wheedle.poller as _poller
 
 LOG = _logging.getLogger('ArtifactPoller')
 
+# Maximum number of concurrent Bodega build existence checks (see
+# ArtifactPoller._bodega_build_status())
+MAX_BODEGA_CHECK_WORKERS = 16
+
+# Matches fnmatch wildcard characters in an artifact name
+_WILDCARD_RE = _re.compile(r'[*?[]')
+
+# Maximum number of downloaded builds waiting to be pushed to Bodega and Stagger. Processing of
+# further builds waits until there is room in the push queue
+MAX_PUSH_QUEUE_SIZE = 4
+
+# Minimum time between checks that Bodega and Stagger are running, unless a connection fails
+SERVICE_CHECK_INTERVAL_SECS = 300
+
+# Maximum number of concurrent artifact downloads (see ArtifactPoller._download_artifacts())
+MAX_DOWNLOAD_WORKERS = 8
+
 
 
 def remove(path):
     """ Remove a file or directory recursively """
-    if not _fortworth.exists(path):
-        return
-    if _fortworth.is_dir(path):
-        _shutil.rmtree(path, ignore_errors=True)
-    else:
-        _os.remove(path)
+    try:
+        if _stat.S_ISDIR(_os.lstat(path).st_mode):
+            _shutil.rmtree(path)
+        else:
+            _os.remove(path)
+    except FileNotFoundError:
+        pass
 
 
 
@@ -61,29 +84,77 @@ class ArtifactPoller(_poller.Poller):
     """ Poller which polls for GitHub actions artifacts at a regular interval """
 
     def __init__(self, config, name, ap_event):
-        self._prev_artifact_ids = {} # JSON artifact list from previous poll
-        self._next_artifact_ids = {} # JSON artifact list for next poll
+        self._prev_artifact_ids = {} # Run number: set of artifact ids from previous poll
+        self._next_artifact_ids = {} # Run number: set of artifact ids for next poll
         self._last_build_commit_hash = None
+        self._last_updated_at = None # updated_at of most recent workflow item from previous poll
+        self._last_list_empty = False # Set if the workflow list was empty on the previous poll
+        self._download_failed = False # Set if an artifact download failed on the previous poll
+        self._saved_last_updated_at = None # last_updated_at as last read or written
+        self._bodega_run_numbers = set() # Run numbers known to be in Bodega
+        self._services_checked_at = None # Monotonic time of last successful service check
         super().__init__(config, name, ap_event, True)
+        self._needed_artifact_names, self._needed_artifact_pattern = \
+            self._compile_artifact_name_list()
+        self._needed_artifact_cache = {} # Artifact name: result of _is_needed_artifact()
+        self._push_queue = _queue.Queue(maxsize=MAX_PUSH_QUEUE_SIZE)
+        # Shared with the push thread, and guarded by _push_lock
+        self._push_lock = _threading.Lock()
+        self._queued_run_numbers = set() # Run numbers queued or being pushed
+        self._pushed_artifact_ids = {} # Run number: set of artifact ids pushed since last write
+        self._push_failed = False # Set if a push failed since the previous poll
+        self._push_service_lost = False # Set if the push thread could not reach Bodega or Stagger
+        self._remove_temp_dirs()
+        _threading.Thread(target=self._push_loop, name=name + '-AP-push', daemon=True).start()
 
     def poll(self):
         """ Perform poll task. Return True if required services are not running, False otherwise """
-        try:
-            # Check if Bodega and Stagger are running
-            self._check_services_running()
-        except _errors.ErrorList as err:
-            for err_item in err:
-                self._log.warning(err_item)
-            return True
-        self._log.info(self._repo.to_str())
+        with self._push_lock:
+            if self._push_failed:
+                # Process the workflow list again even if unchanged, so failed pushes are retried
+                self._push_failed = False
+                self._last_updated_at = None
+            if self._push_service_lost:
+                # Check services again before this poll
+                self._push_service_lost = False
+                self._services_checked_at = None
+        if self._services_checked_at is None or \
+            _time.monotonic() - self._services_checked_at > SERVICE_CHECK_INTERVAL_SECS:
+            try:
+                # Check if Bodega and Stagger are running
+                self._check_services_running()
+            except _errors.ErrorList as err:
+                for err_item in err:
+                    self._log.warning(err_item)
+                return True
+            self._services_checked_at = _time.monotonic()
+        self._log.info('%s', self._repo)
 
         # Obtain workflow list for this repository
         workflow_list = self._repo.workflow_list()
-        if len(workflow_list) > 0:
-            self._log.info('  %s', workflow_list.to_str())
-            self._process_workflow_list(workflow_list)
+        list_empty = len(workflow_list) == 0
+        last_updated_at = None if list_empty else workflow_list.wf_list()[-1].updated_at()
+        if (list_empty and self._last_list_empty) or \
+            (last_updated_at is not None and last_updated_at == self._last_updated_at):
+            # Nothing has changed since the last poll, skip processing
+            self._log.info('  %s - no workflow updates since last poll', workflow_list)
+            self._poll_changed = False
+            self._next_artifact_ids = dict(self._prev_artifact_ids)
+        else:
+            self._poll_changed = True
+            self._download_failed = False
+            if not list_empty:
+                self._log.info('  %s', workflow_list)
+                if self._process_workflow_list(workflow_list):
+                    # Runs with failed downloads are retried by the next poll
+                    if not self._download_failed:
+                        self._last_updated_at = last_updated_at
+                else:
+                    # Bodega could not be reached, check services again on next poll
+                    self._services_checked_at = None
+        self._last_list_empty = list_empty
 
-        # Save persistent data from this poll
+        # Save persistent data from this poll, including the artifact ids of any builds pushed since
         self._write_data()
 
         # Signal commit poller
@@ -93,94 +164,210 @@ class ArtifactPoller(_poller.Poller):
         return False
 
     def _check_services_running(self):
-        """ Check bodega and stagger are running """
-        error_list = []
+        """ Check bodega and stagger are running. Both services are checked concurrently """
+        with _futures.ThreadPoolExecutor(max_workers=2) as executor:
+            future_list = [executor.submit(self._check_bodega_running),
+                           executor.submit(self._check_stagger_running)]
+            error_list = [future.result() for future in future_list
+                          if future.result() is not None]
+        if len(error_list) > 0:
+            raise _errors.ErrorList(error_list)
 
+    def _check_bodega_running(self):
+        """ Check bodega is running. Return a ServiceConnectionError if not, None otherwise """
         try:
             build_data = _fortworth.BuildData(self._repo_name(),
                                               self._source_branch(), 0, None)
             _fortworth.bodega_build_exists(build_data, self._bodega_url())
             self._log.info('Bodega service found at %s', self._bodega_url())
         except _requests.exceptions.ConnectionError:
-            error_list.append(_errors.ServiceConnectionError('Bodega', self._bodega_url()))
+            return _errors.ServiceConnectionError('Bodega', self._bodega_url())
+        return None
 
+    def _check_stagger_running(self):
+        """ Check stagger is running. Return a ServiceConnectionError if not, None otherwise """
         try:
             _fortworth.stagger_get_data(self._stagger_url())
             self._log.info('Stagger service found at %s', self._stagger_url())
         except _requests.exceptions.ConnectionError:
-            error_list.append(_errors.ServiceConnectionError('Stagger', self._stagger_url()))
-        if len(error_list) > 0:
-            raise _errors.ErrorList(error_list)
-
-    def _download_artifact(self, artifact, bodega_artifact_list, bodega_temp_dir):
+            return _errors.ServiceConnectionError('Stagger', self._stagger_url())
+        return None
+
+    def _bodega_build_status(self, wf_item_list):
+        """ Check a list of workflow items against Bodega concurrently. Return a map of run
+            number to True if in Bodega, False if not, or None if Bodega could not be reached. Run
+            numbers already known to be in Bodega from a previous poll are not checked again """
+        build_status = {wf_item.run_number(): True for wf_item in wf_item_list
+                        if wf_item.run_number() in self._bodega_run_numbers}
+        check_list = [wf_item for wf_item in wf_item_list
+                      if wf_item.run_number() not in self._bodega_run_numbers]
+        if len(check_list) > 0:
+            num_workers = min(MAX_BODEGA_CHECK_WORKERS, len(check_list))
+            with _futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+                status_list = executor.map(self._check_in_bodega, check_list)
+                build_status.update({wf_item.run_number(): status for wf_item, status
+                                     in zip(check_list, status_list)})
+        # Only keep run numbers which are still in the workflow list
+        self._bodega_run_numbers = {run_number for run_number, status in build_status.items()
+                                    if status}
+        return build_status
+
+    def _compile_artifact_name_list(self):
+        """ Split the needed artifact name list into a set of plain names and a single compiled
+            regular expression matching any of the names containing wildcards (None if there are
+            no such names) """
         try:
-            downloaded_filename = artifact.download(bodega_temp_dir,
-                                                    self._config.auth())
-            if downloaded_filename == self._last_build_hash_artifact_name():
-                self._process_commit_hash(bodega_temp_dir)
-            bodega_artifact_list.append((artifact, downloaded_filename))
-        except _requests.exceptions.ConnectionError:
-            self._log.warning( \
-                '    %s - ERROR: Bodega not running or invalid Bodega URL %s',
-                artifact.to_str(), format(self._bodega_url()))
-        except _errors.PollerError as err:
-            self._log.warning('    %s - %s', artifact.to_str(), err)
+            artifact_name_list = _fortworth.parse_json(self._build_artifact_name_list())
+        except _json.decoder.JSONDecodeError as err:
+            self._raise_config_error('Invalid value "{}" for "build_artifact_name_list": {}'. \
+                format(self._build_artifact_name_list(), err))
+        names = frozenset(name for name in artifact_name_list if not _WILDCARD_RE.search(name))
+        patterns = [_fnmatch.translate(name) for name in artifact_name_list
+                    if _WILDCARD_RE.search(name)]
+        return names, _re.compile('|'.join(patterns)) if len(patterns) > 0 else None
+
+    def _download_artifacts(self, artifact_list, bodega_artifact_list, bodega_temp_dir):
+        """ Download artifacts concurrently into bodega_temp_dir, and add each successfully
+            downloaded artifact to bodega_artifact_list """
+        if len(artifact_list) == 0:
+            return
+        num_workers = min(MAX_DOWNLOAD_WORKERS, len(artifact_list))
+        with _futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_list = [(artifact, executor.submit(self._download_artifact, artifact,
+                                                      bodega_temp_dir))
+                           for artifact in artifact_list]
+            # Results are handled in submission order, and only on this thread
+            for artifact, future in future_list:
+                try:
+                    downloaded_filename = future.result()
+                    if downloaded_filename == self._last_build_hash_artifact_name():
+                        self._process_commit_hash(bodega_temp_dir)
+                    bodega_artifact_list.append((artifact, downloaded_filename))
+                except _requests.exceptions.ConnectionError:
+                    self._log.warning('    %s - ERROR: Unable to connect to GitHub to download',
+                                      artifact)
+                except _requests.exceptions.HTTPError as err:
+                    self._log.warning('    %s - ERROR: %s', artifact, err)
+                except _errors.PollerError as err:
+                    self._log.warning('    %s - %s', artifact, err)
+                else:
+                    self._log.info('    %s - ok', artifact)
+
+    def _download_artifact(self, artifact, bodega_temp_dir):
+        """ Download an artifact into bodega_temp_dir. Artifacts are downloaded into the artifact
+            cache first, so that if a run is not pushed to Bodega (eg after an error or restart),
+            its artifacts need not be downloaded again when the run is retried by a later poll.
+            Cache entries are removed once pushed, or when their run is no longer polled (see
+            _prune_artifact_cache()) """
+        cache_file_name = self._artifact_cache_file_name(artifact)
+        if _os.path.exists(cache_file_name):
+            self._log.debug('    %s - found in artifact cache', artifact)
         else:
-            self._log.info('    %s - ok', artifact.to_str())
+            _os.makedirs(self._artifact_cache_dir(), exist_ok=True)
+            # Download into a private directory so that only complete downloads enter the cache
+            with _tempfile.TemporaryDirectory(dir=self._artifact_cache_dir()) as download_dir:
+                artifact.download(download_dir, self._config.auth(), self._session)
+                _os.replace(_fortworth.join(download_dir, artifact.name() + '.zip'),
+                            cache_file_name)
+        bodega_file_name = _fortworth.join(bodega_temp_dir, artifact.name() + '.zip')
+        try:
+            _os.link(cache_file_name, bodega_file_name)
+        except OSError:
+            # The file system may not support hard links
+            _shutil.copyfile(cache_file_name, bodega_file_name)
+        return artifact.name()
+
+    def _check_in_bodega(self, wf_item):
+        """ Check if a workflow item's run number is in bodega, None if bodega is unreachable """
+        try:
+            return self._is_in_bodega(wf_item)
+        except _requests.exceptions.ConnectionError:
+            return None
 
     def _is_in_bodega(self, wf_item):
         """ Check if a workflow item's run number is in bodega """
         build_data = _fortworth.BuildData(self._repo.name(), self._source_branch(),
                                           wf_item.run_number(), None)
-        return _fortworth.bodega_build_exists(build_data, self._bodega_url())
+        response = self._session.get(_fortworth.bodega_build_url(build_data, self._bodega_url()))
+        return response.status_code == _requests.codes.ok
 
     def _is_needed_artifact(self, artifact_name):
-        """ Check if an artifact is in the list of needed artifacts """
-        if artifact_name == self._last_build_hash_artifact_name():
-            return True
-        artifact_list = _fortworth.parse_json(self._build_artifact_name_list())
-        for needed_artifact in artifact_list:
-            if _fnmatch.fnmatch(artifact_name, needed_artifact):
-                return True
-        return False
+        """ Check if an artifact is in the list of needed artifacts. As the same artifact names
+            recur in every workflow run, the result is remembered for each name """
+        needed = self._needed_artifact_cache.get(artifact_name)
+        if needed is None:
+            needed = artifact_name == self._last_build_hash_artifact_name() or \
+                artifact_name in self._needed_artifact_names or \
+                (self._needed_artifact_pattern is not None and
+                 self._needed_artifact_pattern.match(artifact_name) is not None)
+            self._needed_artifact_cache[artifact_name] = needed
+        return needed
+
+    def _is_queued_or_pushed(self, wf_item):
+        """ Check if a workflow item is waiting to be pushed, or has been pushed since the last poll
+            (so that a Bodega check made before the push completed is out of date) """
+        with self._push_lock:
+            return wf_item.run_number() in self._queued_run_numbers or \
+                str(wf_item.run_number()) in self._pushed_artifact_ids
 
     def _process_artifacts(self, wf_item):
-        """ Filter, download needed artifacts, push them to Bodega, and tag in Stagger """
+        """ Filter and download needed artifacts, then queue them to be pushed to Bodega and tagged
+            in Stagger. Return True if all needed artifacts were downloaded, False otherwise """
         run_number_str = str(wf_item.run_number()) # JSON uses only strings as keys
-        first_in = True
+        prev_ids = self._prev_artifact_ids.get(run_number_str, ())
+        next_ids = set()
+        download_list = []
         bodega_artifact_list = []
-        bodega_temp_dir = _fortworth.make_temp_dir(suffix='-{}'.format(run_number_str))
+        # Only workflow items with artifacts are processed, so there is always an artifact to list
+        self._log.info('    %s', _gh_api.GhArtifactList.hdr())
         for artifact in wf_item:
-            if first_in:
-                self._log.info('    %s', _gh_api.GhArtifactList.hdr())
-                first_in = False
-            if self._is_needed_artifact(artifact.name()) and not artifact.expired():
-                if run_number_str not in self._prev_artifact_ids or \
-                    artifact.id() not in self._prev_artifact_ids[run_number_str]:
-                    self._download_artifact(artifact, bodega_artifact_list, bodega_temp_dir)
+            if not artifact.expired() and self._is_needed_artifact(artifact.name()):
+                if artifact.id() not in prev_ids:
+                    download_list.append(artifact)
                 else:
-                    self._log.info('    %s - previously downloaded', artifact.to_str())
-                if run_number_str not in self._next_artifact_ids:
-                    self._next_artifact_ids[run_number_str] = [artifact.id()]
-                elif artifact.id() not in self._next_artifact_ids[run_number_str]:
-                    self._next_artifact_ids[run_number_str].append(artifact.id())
+                    self._log.info('    %s - previously downloaded', artifact)
+                    next_ids.add(artifact.id())
             else:
-                self._log.info('    %s - ignored or expired', artifact.to_str())
+                self._log.info('    %s - ignored or expired', artifact)
+        if len(next_ids) > 0:
+            self._next_artifact_ids[run_number_str] = next_ids
+        if len(download_list) == 0:
+            return True
+        # Keep the temp dir on the artifact cache's file system, so that artifacts are linked into
+        # it from the cache rather than copied
+        _os.makedirs(self._artifact_cache_dir(), exist_ok=True)
+        bodega_temp_dir = _tempfile.mkdtemp(prefix='wheedle-', suffix='-{}'.format(run_number_str),
+                                            dir=self._artifact_cache_dir())
+        try:
+            self._download_artifacts(download_list, bodega_artifact_list, bodega_temp_dir)
+        except BaseException:
+            remove(bodega_temp_dir)
+            raise
         if len(bodega_artifact_list) > 0:
-            bodega_artifact_path = self._push_to_bodega(wf_item, bodega_temp_dir)
-            self._push_to_stagger(wf_item, bodega_artifact_list, bodega_artifact_path)
-        remove(bodega_temp_dir)
+            # Push to Bodega and Stagger in the background, the push thread removes the temp dir.
+            # The artifact ids are only recorded once the push succeeds.
+            with self._push_lock:
+                self._queued_run_numbers.add(wf_item.run_number())
+            self._push_queue.put((wf_item, bodega_artifact_list, bodega_temp_dir,
+                                  self._last_build_commit_hash))
+        else:
+            remove(bodega_temp_dir)
+        return len(bodega_artifact_list) == len(download_list)
 
     def _process_commit_hash(self, bodega_temp_dir):
-        """ Extract zipped commit-id json file into data dir """
+        """ Read zipped commit-id json file, and save it in the data dir """
         file_name_base = _fortworth.join(bodega_temp_dir, self._last_build_hash_artifact_name())
+        # Read only the commit hash file straight from the archive, without extracting it to disk
         with _zipfile.ZipFile(file_name_base + '.zip', 'r') as zip_obj:
-            zip_obj.extractall(path=bodega_temp_dir)
-        self._last_build_commit_hash = _fortworth.read_json(file_name_base + '.json')['commit-hash']
-        _shutil.move(file_name_base + '.json', self._last_build_hash_file_name())
+            with zip_obj.open(self._last_build_hash_artifact_name() + '.json') as json_file:
+                last_build_commit = _json.load(json_file)
+        self._last_build_commit_hash = last_build_commit['commit-hash']
+        _poller.write_json(self._last_build_hash_file_name(), last_build_commit)
 
     def _process_workflow_list(self, workflow_list):
-        """ Find artifacts in each workflow that is not already in Bodega """
+        """ Find artifacts in each workflow that is not already in Bodega. Return True if all
+            workflow items could be checked against Bodega, False otherwise. _download_failed is set
+            if any artifact could not be downloaded """
         # Limit number of items with artifacts if needed
         download_limit = self._build_download_limit()
         if download_limit is not None and len(workflow_list) > download_limit:
@@ -192,26 +379,96 @@ class ArtifactPoller(_poller.Poller):
                     cnt += 1
                 if cnt >= download_limit:
                     break
-            workflow_list = reversed(limited_wf_list)
+            workflow_list = list(reversed(limited_wf_list))
+
+        # Check all workflow items with artifacts against Bodega in a single concurrent batch
+        bodega_status = self._bodega_build_status([wf_item for wf_item in workflow_list
+                                                   if wf_item.has_artifacts()])
 
+        all_checked = True
         for wf_item in workflow_list:
             if wf_item.has_artifacts():
                 try:
-                    if not self._is_in_bodega(wf_item):
-                        self._log.info('    %s', wf_item.to_str())
-                        self._process_artifacts(wf_item)
+                    in_bodega = bodega_status[wf_item.run_number()]
+                    if in_bodega is None:
+                        all_checked = False
+                        self._log.warning('    %s - Bodega not running or invalid Bodega URL %s',
+                                          wf_item, self._bodega_url())
+                    elif self._is_queued_or_pushed(wf_item):
+                        self._log.info('    %s - ignored, push in progress or complete', wf_item)
+                        self._transfer_artifact_ids(wf_item)
+                    elif not in_bodega:
+                        self._log.info('    %s', wf_item)
+                        if not self._process_artifacts(wf_item):
+                            self._download_failed = True
                     else:
-                        self._log.info('    %s - ingored, already in Bodega', wf_item.to_str())
-                        # Transfer previously seen artifacts to next list
-                        run_number_str = str(wf_item.run_number())
-                        if run_number_str in self._prev_artifact_ids:
-                            self._next_artifact_ids[run_number_str] = \
-                                self._prev_artifact_ids[run_number_str]
+                        self._log.info('    %s - ingored, already in Bodega', wf_item)
+                        self._transfer_artifact_ids(wf_item)
                 except _requests.exceptions.ConnectionError:
+                    all_checked = False
                     self._log.warning('    %s - Bodega not running or invalid Bodega URL %s',
-                                      wf_item.to_str(), self._bodega_url())
+                                      wf_item, self._bodega_url())
+            else:
+                self._log.info('    %s', wf_item)
+        self._prune_artifact_cache(workflow_list)
+        return all_checked
+
+    def _prune_artifact_cache(self, workflow_list):
+        """ Remove artifact cache entries which do not belong to a workflow item in workflow_list.
+            These are left by runs which can no longer be retried, eg because they have dropped out
+            of the workflow list or the build download limit """
+        if not _os.path.isdir(self._artifact_cache_dir()):
+            return
+        artifact_ids = {str(artifact.id()) for wf_item in workflow_list if wf_item.has_artifacts()
+                        for artifact in wf_item}
+        for file_name in _os.listdir(self._artifact_cache_dir()):
+            artifact_id, ext = _os.path.splitext(file_name)
+            # Other names are downloads or builds in progress
+            if ext == '.zip' and artifact_id not in artifact_ids:
+                remove(_fortworth.join(self._artifact_cache_dir(), file_name))
+
+    def _push_build(self, wf_item, bodega_artifact_list, bodega_temp_dir, commit_hash):
+        """ Push downloaded artifacts to Bodega and tag them in Stagger. Return True if the build
+            was pushed (or this is a dry run), False otherwise """
+        bodega_artifact_path = self._push_to_bodega(wf_item, bodega_temp_dir)
+        if bodega_artifact_path is None and not self._dry_run():
+            # Not in Bodega, so there is nothing for a Stagger tag to point to
+            return False
+        self._push_to_stagger(wf_item, bodega_artifact_list, bodega_artifact_path, commit_hash)
+        # Artifacts no longer needed in artifact cache
+        for artifact, _ in bodega_artifact_list:
+            remove(self._artifact_cache_file_name(artifact))
+        return True
+
+    def _push_loop(self):
+        """ Push thread: push builds from the push queue in the order in which they were queued """
+        while True:
+            wf_item, bodega_artifact_list, bodega_temp_dir, commit_hash = self._push_queue.get()
+            pushed = False
+            try:
+                pushed = self._push_build(wf_item, bodega_artifact_list, bodega_temp_dir,
+                                          commit_hash)
+            except Exception: # pylint: disable=broad-except
+                self._log.exception('    %s - ERROR: Unable to push build', wf_item)
+            finally:
+                self._push_complete(wf_item, bodega_artifact_list, pushed)
+                self._push_queue.task_done()
+            try:
+                remove(bodega_temp_dir)
+            except Exception: # pylint: disable=broad-except
+                # The push thread must keep running, or the poller blocks when the queue is full
+                self._log.exception('Unable to remove temporary directory %s', bodega_temp_dir)
+
+    def _push_complete(self, wf_item, bodega_artifact_list, pushed):
+        """ Record the outcome of a push for the poller thread. The artifact ids of a pushed build
+            are saved with the next poll, a failed build is retried by the next poll """
+        with self._push_lock:
+            self._queued_run_numbers.discard(wf_item.run_number())
+            if pushed:
+                self._pushed_artifact_ids.setdefault(str(wf_item.run_number()), set()).update( \
+                    artifact.id() for artifact, _ in bodega_artifact_list)
             else:
-                self._log.info('    %s', wf_item.to_str())
+                self._push_failed = True
 
     def _push_to_bodega(self, wf_item, bodega_temp_dir):
         """ Push an artifact to Bodega """
@@ -221,14 +478,16 @@ class ArtifactPoller(_poller.Poller):
             try:
                 _fortworth.bodega_put_build(bodega_temp_dir, build_data,
                                             service_url=self._bodega_url())
-                return _fortworth.join(self._bodega_url(), build_data.repo, build_data.branch,
-                                       str(build_data.id))
+                return _fortworth.bodega_build_url(build_data, service_url=self._bodega_url())
             except _requests.exceptions.ConnectionError:
+                with self._push_lock:
+                    self._push_service_lost = True
                 self._log.error('Bodega not running or invalid Bodega URL %s',
-                                self._config['Local']['stagger_url'])
+                                self._bodega_url())
 
 
-    def _push_to_stagger(self, workflow_metadata, bodega_artifact_list, bodega_artifact_path):
+    def _push_to_stagger(self, workflow_metadata, bodega_artifact_list, bodega_artifact_path,
+                         commit_hash):
         """ Tag an artifact in Stagger """
         if not self._dry_run():
             stagger_artifact_list = {}
@@ -236,15 +495,14 @@ class ArtifactPoller(_poller.Poller):
                 stagger_artifact_list[artifact.name()] = {
                     'type': 'file',
                     'update_time': _gh_api.str_time_to_milli_ts(artifact.created_at()),
-                    'url': _fortworth.join(bodega_artifact_path, bodega_file_name + '.zip'),
+                    'url': '{}/{}.zip'.format(bodega_artifact_path, bodega_file_name),
                     }
             commit_url = None if self._source_repo_full_name() is None else \
-                'https://github.com/{}/commit/{}'.format(self._source_repo_full_name(),
-                                                         self._last_build_commit_hash)
+                'https://github.com/{}/commit/{}'.format(self._source_repo_full_name(), commit_hash)
             tag_data = {'update_time': _gh_api.str_time_to_milli_ts(workflow_metadata.updated_at()),
                         'build_id': workflow_metadata.run_number(),
                         'build_url': workflow_metadata.html_url(),
-                        'commit_id': self._last_build_commit_hash,
+                        'commit_id': commit_hash,
                         'commit_url': commit_url,
                         'artifacts': stagger_artifact_list,
                        }
@@ -253,27 +511,84 @@ class ArtifactPoller(_poller.Poller):
                                            self._stagger_tag(), tag_data,
                                            service_url=self._stagger_url())
             except _requests.exceptions.ConnectionError:
-                self._log.error('Stagger not running or invalid Bodega URL %s', self._stagger_url())
+                with self._push_lock:
+                    self._push_service_lost = True
+                self._log.error('Stagger not running or invalid Stagger URL %s',
+                                self._stagger_url())
 
     def _read_data(self):
         """ Read the persistent data for this poller """
         if _fortworth.exists(self._data_file_name()):
             try:
-                self._prev_artifact_ids = _fortworth.read_json(self._data_file_name())
+                data = _fortworth.read_json(self._data_file_name())
             except  _json.decoder.JSONDecodeError as err:
                 raise _errors.JsonDecodeError(self._data_file_name(), err)
+            if 'artifact_ids' in data:
+                artifact_ids = data['artifact_ids']
+                self._last_updated_at = data.get('last_updated_at')
+                self._saved_last_updated_at = self._last_updated_at
+            else:
+                # Older data files contain only the artifact ids
+                artifact_ids = data
+            self._prev_artifact_ids = {run_number_str: set(id_list) for run_number_str, id_list
+                                       in artifact_ids.items()}
+
+    def _remove_temp_dirs(self):
+        """ Remove the download and build temp dirs left in the artifact cache dir if a previous run
+            of the application stopped before they were removed """
+        if not _os.path.isdir(self._artifact_cache_dir()):
+            return
+        for file_name in _os.listdir(self._artifact_cache_dir()):
+            path = _fortworth.join(self._artifact_cache_dir(), file_name)
+            if _os.path.isdir(path):
+                remove(path)
+
+    def _transfer_artifact_ids(self, wf_item):
+        """ Transfer previously seen artifact ids of a workflow item to the next list """
+        run_number_str = str(wf_item.run_number())
+        if run_number_str in self._prev_artifact_ids:
+            self._next_artifact_ids[run_number_str] = self._prev_artifact_ids[run_number_str]
 
     def _validate(self):
         pass
 
     def _write_data(self):
-        """ Write the persistent data for this poller """
-        _fortworth.write_json(self._data_file_name(), self._next_artifact_ids)
+        """ Write the persistent data for this poller, unless it is unchanged """
+        with self._push_lock:
+            pushed_artifact_ids = self._pushed_artifact_ids
+            self._pushed_artifact_ids = {}
+            # While builds wait to be pushed or artifact downloads have failed, do not save the time
+            # of the last workflow update, so that after a restart the workflow list is processed
+            # again, and the builds requeued or downloads retried
+            last_updated_at = None if len(self._queued_run_numbers) > 0 or self._download_failed \
+                else self._last_updated_at
+        for run_number_str, id_set in pushed_artifact_ids.items():
+            # New sets, so that sets shared with the previous artifact ids are not changed
+            self._next_artifact_ids[run_number_str] = \
+                self._next_artifact_ids.get(run_number_str, set()) | id_set
+        if self._next_artifact_ids != self._prev_artifact_ids or \
+            last_updated_at != self._saved_last_updated_at or \
+            not _fortworth.exists(self._data_file_name()):
+            self._write_data_file(last_updated_at)
         self._prev_artifact_ids = self._next_artifact_ids
         self._next_artifact_ids = {}
 
+    def _write_data_file(self, last_updated_at):
+        """ Write the persistent data file for this poller """
+        _poller.write_json(self._data_file_name(),
+                           {'artifact_ids': {run_number_str: sorted(id_set) for run_number_str,
+                                             id_set in self._next_artifact_ids.items()},
+                            'last_updated_at': last_updated_at})
+        self._saved_last_updated_at = last_updated_at
+
     # Configuration convenience methods
 
+    def _artifact_cache_dir(self):
+        return _fortworth.join(self._config.data_dir(), 'artifact-cache.{}'.format(self._name))
+
+    def _artifact_cache_file_name(self, artifact):
+        return _fortworth.join(self._artifact_cache_dir(), '{}.zip'.format(artifact.id()))
+
     def _bodega_url(self):
         return self._poller_config()['bodega_url']
 
@@ -333,13 +648,10 @@ class ArtifactPoller(_poller.Poller):
 
     @staticmethod
     def run(config, name, ap_event):
-        """ Convenience method to run the ArtifactPoller on a scheduler """
+        """ Convenience method to run the ArtifactPoller until interrupted """
         LOG.info('Starting artifact poller "%s"...', name)
         try:
-            sch = _sched.scheduler(_time.time, _time.sleep)
-            artifact_poller = ArtifactPoller(config, name, ap_event)
-            sch.enter(0, 1, artifact_poller.start, (sch, ))
-            sch.run()
+            ArtifactPoller(config, name, ap_event).start()
         except (_errors.PollerError) as err:
             LOG.error(err)
             LOG.info('Poller "%s" exiting owing to previous error', name)
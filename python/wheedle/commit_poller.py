@@ -29,8 +29,7 @@ new build is triggered.
 """
 
 import logging as _logging
-import sched as _sched
-import time as _time
+import os as _os
 
 import fortworth as _fortworth
 import wheedle.errors as _errors
@@ -41,6 +40,12 @@ import wheedle.poller as _poller
 
 LOG = _logging.getLogger('CommitPoller')
 
+# Number of commits requested per page
+COMMIT_PAGE_SIZE = 100
+
+# Maximum number of commit pages read when searching for the last build commit
+MAX_COMMIT_PAGES = 3
+
 
 
 class CommitPoller(_poller.Poller):
@@ -48,8 +53,13 @@ class CommitPoller(_poller.Poller):
 
     def __init__(self, config, name, ap_event):
         self._last_build_commit_hash = None
+        self._up_to_date_hash = None # Last build hash when last poll found no new commits
+        self._last_build_hash_mtime = None # Modification time of last build hash file when read
         self._data = {}
+        self._saved_data = None # Copy of persistent data as last read or written
         super().__init__(config, name, ap_event, False)
+        self._dispatch_url = '{}/repos/{}/dispatches'.format(self._config['GitHub']['service_url'],
+                                                             self._build_repo_full_name())
 
     def poll(self):
         """ Read commits from source repository, compare with last commit id of build """
@@ -61,31 +71,19 @@ class CommitPoller(_poller.Poller):
         # Read last commit hash file, it might have been updated since last poll
         self._read_last_commit_hash()
 
-        # Read commit list one page at a time
         commits_since_build_trigger = []
-        page = 0
-        hash_found = False
-        self._log.info('Reading commits from repository "%s"...', self._repo.full_name())
-        while True:
-            commit_list_page = self._repo.commit_list(page=page)
-            page += 1
-            if len(commit_list_page) == 0:
-                # Raise error if no commits (page == 0)
-                if page == 0:
-                    raise _errors.EmptyCommitListError(self._repo)
-                # Stop if no commits and page > 0
-                break
-            # Only commits since last build commit are part of this build
-            # Search back from first commit (most recent) until matching hash is found
-            if self._last_build_commit_hash is not None:
-                for commit in commit_list_page:
-                    if commit.hash() == self._last_build_commit_hash:
-                        hash_found = True
-                        break
-                    commits_since_build_trigger.append(commit)
-            # Stop if less than a full page is received, or at 5 pages
-            if hash_found or len(commit_list_page) < 50 or page >= 5:
-                break
+        if self._last_build_commit_hash is not None:
+            self._log.info('Reading commits from repository "%s"...', self._repo.full_name())
+            # If the commit date of the last build is known, normally only the commits since that
+            # date need to be read, which takes a single request
+            since = self._last_build_commit_date()
+            commits_since_build_trigger, hash_found = self._read_commits_since_build(since)
+            if not hash_found and since is not None:
+                # Last build commit not found since its commit date (history may have been
+                # rewritten), search the latest commits instead
+                commits_since_build_trigger, _ = self._read_commits_since_build()
+        self._up_to_date_hash = None
+        self._poll_changed = True
         if self._last_build_commit_hash is None:
             self._log.info('No previous build commit hash found, forcing a build')
             self._trigger_build()
@@ -95,19 +93,70 @@ class CommitPoller(_poller.Poller):
             self._log.info('%d commit%s since last build trigger:', num_commits, suffix)
             self._log.info('  %s', _gh_api.GhCommitList.hdr())
             for commit in commits_since_build_trigger:
-                self._log.info('  %s', commit.to_str())
+                self._log.info('  %s', commit)
             self._trigger_build()
         else:
             self._log.info('No commits since last build')
+            self._up_to_date_hash = self._last_build_commit_hash
+            self._poll_changed = False
 
         self._write_data()
         return False
 
+    def _is_up_to_date(self, commit_list_page):
+        """ Return True if the first commit list page is unchanged since a previous poll which found
+            no new commits for the same last build hash """
+        return not commit_list_page.is_modified() and \
+            self._last_build_commit_hash is not None and \
+            self._last_build_commit_hash == self._up_to_date_hash
+
+    def _last_build_commit_date(self):
+        """ Return the commit date of the last build commit if known from a previous poll, None
+            otherwise """
+        last_build_commit = self._data.get('last-build-commit')
+        if last_build_commit is not None and \
+            last_build_commit['hash'] == self._last_build_commit_hash:
+            return last_build_commit['date']
+        return None
+
+    def _read_commits_since_build(self, since=None):
+        """ Read commits one page at a time until the last build commit is found, optionally only
+            those since commit date since. Return tuple (commit list, hash_found), where commit list
+            contains the commits which are more recent than the last build commit """
+        commits_since_build_trigger = []
+        for page in range(1, MAX_COMMIT_PAGES + 1):
+            commit_list_page = self._repo.commit_list(since=since, per_page=COMMIT_PAGE_SIZE,
+                                                      page=page)
+            if page == 1 and self._is_up_to_date(commit_list_page):
+                # Neither the commits nor the last build hash have changed since the last poll
+                return [], True
+            if len(commit_list_page) == 0:
+                # Raise error if no commits at all
+                if page == 1 and since is None:
+                    raise _errors.EmptyCommitListError(self._repo)
+                break
+            # Find the last build commit in the page, commits before it (more recent) are new
+            page_commits = commit_list_page.commit_list()
+            try:
+                index = [commit.hash() for commit in page_commits].index( \
+                    self._last_build_commit_hash)
+            except ValueError:
+                commits_since_build_trigger.extend(page_commits)
+            else:
+                commits_since_build_trigger.extend(page_commits[:index])
+                self._data['last-build-commit'] = {'hash': page_commits[index].hash(),
+                                                   'date': page_commits[index].date()}
+                return commits_since_build_trigger, True
+            # Stop if less than a full page is received
+            if len(commit_list_page) < COMMIT_PAGE_SIZE:
+                break
+        return commits_since_build_trigger, False
+
     def _read_data(self):
         """ Read the persistent data for this poller """
         if _fortworth.exists(self._data_file_name()):
             self._data = _fortworth.read_json(self._data_file_name())
-            #self._log.info('Last build trigger: %s for sha %s', '<date>', '<build-sha>')
+            self._saved_data = dict(self._data)
         else:
             self._log.info('No previous build trigger(s) found - missing file "%s"',
                            self._data_file_name())
@@ -115,12 +164,20 @@ class CommitPoller(_poller.Poller):
     def _read_last_commit_hash(self):
         """ Read the commit hash of any previous build that might have been made """
         last_commit_hash_file_name = self._last_build_hash_file_name()
-        if _fortworth.exists(last_commit_hash_file_name):
-            last_build_commit = _fortworth.read_json(last_commit_hash_file_name)
-            self._last_build_commit_hash = last_build_commit['commit-hash']
+        try:
+            mtime = _os.stat(last_commit_hash_file_name).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None:
+            # Only re-read the file if it has changed since it was last read
+            if mtime != self._last_build_hash_mtime:
+                last_build_commit = _fortworth.read_json(last_commit_hash_file_name)
+                self._last_build_commit_hash = last_build_commit['commit-hash']
+                self._last_build_hash_mtime = mtime
             self._log.info('Last build hash: %s', self._last_build_commit_hash)
         else:
             self._last_build_commit_hash = None
+            self._last_build_hash_mtime = None
             self._log.info('No last build hash found - missing file "%s"',
                            last_commit_hash_file_name)
 
@@ -128,8 +185,7 @@ class CommitPoller(_poller.Poller):
         """ Trigger a GitHub action """
         if not self._dry_run():
             _gh_api.gh_http_post_request( \
-                '{}/repos/{}/dispatches'.format(self._config['GitHub']['service_url'],
-                                                self._build_repo_full_name()),
+                self._dispatch_url,
                 auth=self._config.auth(),
                 params={'accept': 'application/vnd.github.v3+json'},
                 json={'event_type': 'trigger-action'})
@@ -141,8 +197,11 @@ class CommitPoller(_poller.Poller):
         pass
 
     def _write_data(self):
-        """ Write the persistent data for this poller """
-        _fortworth.write_json(self._data_file_name(), self._data)
+        """ Write the persistent data for this poller, unless it is unchanged """
+        if self._data == self._saved_data:
+            return
+        _poller.write_json(self._data_file_name(), self._data)
+        self._saved_data = dict(self._data)
 
     # Configuration convenience methods
 
@@ -167,13 +226,10 @@ class CommitPoller(_poller.Poller):
 
     @staticmethod
     def run(config, name, ap_event):
-        """ Convenience method to run the CommitPoller on a scheduler """
+        """ Convenience method to run the CommitPoller until interrupted """
         LOG.info('Starting commit poller "%s"...', name)
         try:
-            sch = _sched.scheduler(_time.time, _time.sleep)
-            commit_poller = CommitPoller(config, name, ap_event)
-            sch.enter(0, 1, commit_poller.start, (sch, ))
-            sch.run()
+            CommitPoller(config, name, ap_event).start()
         except (_errors.PollerError) as err:
             LOG.error(err)
             LOG.info('Poller "%s" exiting owing to previous error', name)
@@ -28,14 +28,22 @@ import wheedle.errors as _errors
 
 
 
+# Config file sections which are not poller sections
+NON_POLLER_SECTIONS = frozenset(('Local', 'GitHub', 'Logging', 'DEFAULT'))
+
+
+
 class Configuration:
     """ Class holding configuration for app """
 
     def __init__(self, config_file_name, data_dir):
         self._config_file_name = config_file_name
         self._config = _cp.ConfigParser()
+        self._sections = {} # Section name: dict of section keys and values
         try:
             self._read_config_file(config_file_name)
+            self._poller_names = tuple(section for section in self._config.sections()
+                                       if section not in NON_POLLER_SECTIONS)
             self._validate()
         except _cp.ParsingError as err:
             print('Config file error: {}'.format(err))
@@ -49,10 +57,10 @@ class Configuration:
         self._auth = (self._config['GitHub']['api_auth_uid'], self._read_token(auth_token_file))
 
     def __contains__(self, val):
-        return val in self._config
+        return val in self._sections
 
     def __getitem__(self, key):
-        return self._config.__getitem__(key)
+        return self._sections[key]
 
     def auth(self):
         """ Return GitHub authorization token """
@@ -68,18 +76,17 @@ class Configuration:
 
     def has_commit_poller(self, name):
         """ Return True if a commit poller is configured for section name """
-        return 'source_repo_owner' in self._config[name]
+        return 'source_repo_owner' in self._sections[name]
 
     def poller_names(self):
-        """ Return list of pollers """
-        return [i for i in self._config.sections() if i not in ['Local', 'GitHub', 'Logging',
-                                                                'DEFAULT']]
+        """ Return tuple of poller names """
+        return self._poller_names
 
-    def _check_all_in_list(self, config_section, test_list, target_list, descr):
-        if not all(elt in target_list for elt in test_list):
+    def _check_all_in_list(self, config_section, test_list, target, descr):
+        missing = [elt for elt in test_list if elt not in target]
+        if len(missing) > 0:
             raise _errors.ConfigFileError(self._config_file_name, config_section, \
-                'Required {} missing: {}'.format(descr,
-                                                 [i for i in test_list if i not in target_list]))
+                'Required {} missing: {}'.format(descr, missing))
 
     def _check_artifact_poller(self, key):
         self._check_keys(['bodega_url', 'build_artifact_name_list', 'build_repo_name',
@@ -96,25 +103,22 @@ class Configuration:
                               'commit_poller_polling_interval_secs'], key)
 
     def _check_keys(self, key_list, section=None):
-        target_list = []
-        if section is None:
-            target_list = self._config.sections()
-        else:
-            for key in self[section]:
-                target_list.append(key)
+        # Section dicts and sets give constant time membership tests
+        target = set(self._config.sections()) if section is None else self[section]
         descr = 'section(s)' if section is None else 'key(s)'
-        self._check_all_in_list(section, key_list, target_list, descr)
+        self._check_all_in_list(section, key_list, target, descr)
 
     def _check_pollers(self):
-        poller_keys = [i for i in self._config.sections() if i not in ['Local', 'GitHub', 'Logging',
-                                                                       'DEFAULT']]
-        for poller_key in poller_keys:
+        for poller_key in self._poller_names:
             self._check_artifact_poller(poller_key)
             self._check_commit_poller(poller_key)
 
     def _read_config_file(self, config_file_name):
         try:
             self._config.read(config_file_name)
+            # Resolve each section into a plain dict once, so that lookups need no interpolation
+            self._sections = {section: dict(self._config[section])
+                              for section in self._config.sections()}
         except _cp.Error as err:
             raise _errors.ConfigFileError(self._config_file_name, None, err)
 
@@ -71,17 +71,8 @@ class ErrorList(PollerError):
     """ Allows multiple exception objects to be raised together """
 
     def __init__(self, error_list):
-        self._error_list = error_list
-        err_msg = ''
-        if len(error_list) > 0:
-            first = True
-            for error in error_list:
-                if not first:
-                    err_msg += '\n'
-                err_msg += str(error)
-                first = False
-        else:
-            err_msg = '[]'
+        self._error_list = list(error_list)
+        err_msg = '\n'.join(str(error) for error in self._error_list) if self._error_list else '[]'
         super().__init__(err_msg)
 
     def contains_class(self, clazz):
@@ -21,27 +21,250 @@
 Classes representing various GitHub API calls.
 """
 
+import collections as _collections
 import datetime as _datetime
+import functools as _functools
+import json as _json
+import logging as _logging
+import shutil as _shutil
+import sqlite3 as _sqlite3
+import threading as _threading
 import time as _time
 import requests as _requests
+import requests.adapters as _adapters
+import urllib3.util.retry as _retry
 
 import fortworth as _fortworth
 import wheedle.errors as _errors
 
 
 # Chunk size for HTTP transfer of files (see GhArtifactItem.download())
-MAX_DOWNLOAD_CHUNK_SIZE = 32768
+MAX_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Size of HTTP connection pool for sessions (see create_session())
+MAX_POOL_CONNECTIONS = 16
+
+# Maximum number of responses held in the ETag cache (see EtagCache)
+MAX_ETAG_CACHE_ENTRIES = 500
+
+# Minimum time between commits of ETag cache changes to its database (see EtagCache)
+ETAG_CACHE_COMMIT_INTERVAL_SECS = 60
+
+LOG = _logging.getLogger('GhApi')
+
+
+
+class EtagCache:
+    """ Cache of GitHub response ETags and their JSON bodies, keyed by request URL and params. The
+        cache is held in memory, and if opened on a file, is also persisted in an SQLite database
+        so that it survives a restart. Both hold at most MAX_ETAG_CACHE_ENTRIES entries, evicting
+        the least recently used. Database changes are committed at most once every
+        ETAG_CACHE_COMMIT_INTERVAL_SECS seconds, and when the cache is closed """
+
+    def __init__(self):
+        self._cache = _collections.OrderedDict()
+        self._db = None
+        self._lock = _threading.Lock()
+        self._committed_at = None
+        self._used_at = {} # Time each entry was last used, not yet written to the database
+
+    def close(self):
+        """ Commit any pending changes and close the database, leaving the cache in memory only """
+        with self._lock:
+            if self._db is not None:
+                self._commit(True)
+                self._db.close()
+                self._db = None
+
+    def get(self, url, params):
+        """ Return tuple (etag, body) for this request, or None if not cached """
+        key = self._key(url, params)
+        with self._lock:
+            if key not in self._cache and self._db is not None:
+                row = self._db.execute('SELECT etag, body_json FROM etag_cache WHERE key = ?',
+                                       (key, )).fetchone()
+                if row is not None:
+                    self._add(key, (row[0], _json.loads(row[1])))
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                if self._db is not None:
+                    self._used_at[key] = _time.time()
+                    self._commit(False)
+            return entry
+
+    def open(self, file_name):
+        """ Persist this cache in SQLite database file file_name, creating it if needed """
+        with self._lock:
+            if self._db is not None:
+                self._commit(True)
+                self._db.close()
+            self._db = _sqlite3.connect(file_name, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS etag_cache (key TEXT PRIMARY KEY, '
+                             'etag TEXT, body_json TEXT, fetched_at REAL)')
+            self._commit(True)
+
+    def put(self, url, params, etag, body):
+        """ Add or replace the ETag and body for this request """
+        key = self._key(url, params)
+        with self._lock:
+            self._add(key, (etag, body))
+            if self._db is not None:
+                self._used_at.pop(key, None)
+                self._db.execute('INSERT OR REPLACE INTO etag_cache VALUES (?, ?, ?, ?)',
+                                 (key, etag, _json.dumps(body), _time.time()))
+                self._commit(False)
+
+    def _add(self, key, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > MAX_ETAG_CACHE_ENTRIES:
+            self._cache.popitem(last=False)
+
+    def _commit(self, force):
+        """ Write the pending use times, evict the least recently used entries beyond
+            MAX_ETAG_CACHE_ENTRIES and commit, if forced or the commit interval has passed. The
+            fetched_at column holds the time each entry was last fetched or used. Call with the
+            lock held and the database open """
+        now = _time.monotonic()
+        if not force and self._committed_at is not None and \
+                now - self._committed_at < ETAG_CACHE_COMMIT_INTERVAL_SECS:
+            return
+        self._db.executemany('UPDATE etag_cache SET fetched_at = ? WHERE key = ?',
+                             [(used_at, key) for key, used_at in self._used_at.items()])
+        self._used_at = {}
+        self._db.execute('DELETE FROM etag_cache WHERE key NOT IN (SELECT key FROM etag_cache '
+                         'ORDER BY fetched_at DESC LIMIT ?)', (MAX_ETAG_CACHE_ENTRIES, ))
+        self._db.commit()
+        self._committed_at = now
+
+    @staticmethod
+    def _key(url, params):
+        if params is None:
+            return url
+        return '{}?{}'.format(url, '&'.join('{}={}'.format(key, val)
+                                            for key, val in sorted(params.items())))
+
+
+
+# ETag cache used for all GitHub GET requests
+ETAG_CACHE = EtagCache()
+
+
+
+class GhRateLimiter:
+    """ Tracks the GitHub API rate limit using the X-RateLimit-* and Retry-After response headers,
+        and holds back requests when the limit is used up until GitHub resets it """
+
+    def __init__(self):
+        self._lock = _threading.Lock()
+        self._remaining = None # Requests remaining in current rate limit window
+        self._reset_time = None # Unix time at which current rate limit window resets
+        self._retry_time = None # Unix time before which no request should be made
+
+    def acquire(self):
+        """ Wait until a request may be made within the rate limit """
+        with self._lock:
+            wait_until = self._retry_time if self._retry_time is not None else 0
+            if self._remaining is not None and self._remaining <= 0 and \
+                self._reset_time is not None:
+                wait_until = max(wait_until, self._reset_time)
+            wait_secs = wait_until - _time.time()
+            if wait_secs <= 0 and self._remaining is not None:
+                self._remaining -= 1
+        if wait_secs > 0:
+            LOG.warning('GitHub rate limit reached, waiting %d secs...', wait_secs)
+            _time.sleep(wait_secs)
+            with self._lock:
+                self._remaining = None
+                self._retry_time = None
+
+    def update(self, response):
+        """ Update rate limit from response headers. Return True if the request was refused
+            because of the rate limit and may be retried, False otherwise """
+        with self._lock:
+            headers = response.headers
+            if 'X-RateLimit-Remaining' in headers:
+                self._remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset' in headers:
+                self._reset_time = int(headers['X-RateLimit-Reset'])
+            if 'Retry-After' in headers:
+                self._retry_time = _time.time() + int(headers['Retry-After'])
+            return response.status_code in [_requests.codes.forbidden,
+                                            _requests.codes.too_many_requests] and \
+                ('Retry-After' in headers or self._remaining == 0)
+
+
+
+# Rate limiter used for all GitHub requests, shared by all poller threads
+RATE_LIMITER = GhRateLimiter()
+
+
+
+def _gh_request(method, url, session=None, **kwargs):
+    """ Send a HTTP request to GitHub within the rate limit, retrying once if it is refused because
+        the rate limit was exceeded """
+    send = SESSION.request if session is None else session.request
+    for _ in range(2):
+        RATE_LIMITER.acquire()
+        resp = send(method, url, **kwargs)
+        if not RATE_LIMITER.update(resp):
+            break
+        resp.close()
+    return resp
+
+
+
+def create_session():
+    """ Create a HTTP session which keeps connections alive for reuse, and which retries requests
+        that fail with a gateway or availability error. If the error persists, the last response
+        is returned (rather than raising RetryError), so that callers handle it like any other
+        error status """
+    session = _requests.Session()
+    adapter = _adapters.HTTPAdapter(pool_connections=MAX_POOL_CONNECTIONS,
+                                    pool_maxsize=MAX_POOL_CONNECTIONS,
+                                    max_retries=_retry.Retry(total=3, backoff_factor=0.5,
+                                                             status_forcelist=[502, 503, 504],
+                                                             raise_on_status=False))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+
+# Session shared by all pollers, and used for GitHub requests not made on a specific session
+SESSION = create_session()
 
 
 
 def gh_http_get_request(url, auth=None, params=None, content_type='json'):
-    """ Send HTTP GET request to GitHub """
+    """ Send HTTP GET request to GitHub. This is a conditional request (see
+        gh_http_conditional_get_request()), so an unchanged response is returned from the ETag cache
+        without counting against the GitHub API rate limit. """
+    return gh_http_conditional_get_request(url, auth=auth, params=params,
+                                           content_type=content_type)[0]
+
+
+
+def gh_http_conditional_get_request(url, auth=None, params=None, content_type='json'):
+    """ Send HTTP GET request to GitHub with the ETag of the last response to the same request (if
+        any). Return tuple (json, modified), where modified is False if GitHub returned 304 (Not
+        Modified) and json is the cached body of the previous response. Conditional requests which
+        return 304 do not count against the GitHub API rate limit. """
+    cached = ETAG_CACHE.get(url, params)
+    headers = {'If-None-Match': cached[0]} if cached is not None else None
     try:
-        resp = _requests.get(url, auth=auth, params=params)
+        resp = _gh_request('GET', url, auth=auth, params=params, headers=headers)
+        if cached is not None and resp.status_code == _requests.codes.not_modified:
+            LOG.debug('ETag cache hit: %s', url)
+            return cached[1], False
         resp.raise_for_status()
         if content_type not in resp.headers['content-type']:
             raise _errors.ContentTypeError(resp)
-        return resp.json()
+        body = resp.json()
+        if 'ETag' in resp.headers:
+            ETAG_CACHE.put(url, params, resp.headers['ETag'], body)
+        return body, True
     except _requests.exceptions.ConnectionError:
         raise _errors.GhConnectionRefusedError(url)
     except _requests.exceptions.HTTPError as err:
@@ -52,16 +275,17 @@ def gh_http_get_request(url, auth=None, params=None, content_type='json'):
 def gh_http_post_request(url, auth=None, data=None, json=None, params=None):
     """ Send HTTP POST request to GitHub """
     try:
-        resp = _requests.post(url, auth=auth, data=data, json=json, params=params)
+        resp = _gh_request('POST', url, auth=auth, data=data, json=json, params=params)
         resp.raise_for_status()
     except _requests.exceptions.HTTPError as err:
-        raise _errors.HttpError('GET', resp, err)
+        raise _errors.HttpError('POST', resp, err)
 
 
 
+@_functools.lru_cache(maxsize=4096)
 def str_time_to_unix_ts(str_time):
     """ Convert timestamp in ISO 8601 to unix timestamp in seconds """
-    return _time.mktime(_datetime.datetime.strptime(str_time, '%Y-%m-%dT%H:%M:%S%z').timetuple())
+    return _datetime.datetime.fromisoformat(str_time.replace('Z', '+00:00')).timestamp()
 
 
 
@@ -90,6 +314,8 @@ class GhRepositoryData:
 class MetadataMap:
     """ Parent class for mapped metadata """
 
+    __slots__ = ('_metadata', )
+
     def __init__(self, metadata):
         self._metadata = metadata
 
@@ -110,18 +336,29 @@ class MetadataMap:
 class GhArtifactItem(MetadataMap):
     """ Single artifact metadata """
 
+    # Frequently used fields are extracted once on construction
+    __slots__ = ('_id', '_name', '_created_ts', '_expired')
+
+    def __init__(self, metadata):
+        super().__init__(metadata)
+        self._id = metadata['id']
+        self._name = metadata['name']
+        self._created_ts = str_time_to_unix_ts(metadata['created_at'])
+        self._expired = metadata['expired']
+
     def created_at(self):
         """ Return artifact created date/time in ISO 8601 format """
         return self._metadata['created_at']
 
-    def download(self, data_dir, auth):
-        """ Download artifact to data_dir """
-        with _requests.get(self._download_url(), stream=True, auth=auth) as req:
+    def download(self, data_dir, auth, session=None):
+        """ Download artifact to data_dir, using session if provided """
+        with _gh_request('GET', self._download_url(), session=session, stream=True,
+                         auth=auth) as req:
             req.raise_for_status()
+            req.raw.decode_content = True
             artifact_file_name = _fortworth.join(data_dir, self.name() + '.zip')
             with open(artifact_file_name, 'wb') as artifact_file:
-                for chunk in req.iter_content(chunk_size=MAX_DOWNLOAD_CHUNK_SIZE):
-                    artifact_file.write(chunk)
+                _shutil.copyfileobj(req.raw, artifact_file, MAX_DOWNLOAD_CHUNK_SIZE)
             return self.name()
         return None
 
@@ -130,16 +367,16 @@ class GhArtifactItem(MetadataMap):
 
     def expired(self):
         """ Return True if artifact has expired, False if not """
-        return self._metadata['expired']
+        return self._expired
 
         # pylint: disable=invalid-name
     def id(self):
         """ Return artifact id """
-        return self._metadata['id']
+        return self._id
 
     def name(self):
         """ Return artifact name """
-        return self._metadata['name']
+        return self._name
 
     def size_in_bytes(self):
         """ Return artifact size in bytes """
@@ -155,12 +392,15 @@ class GhArtifactItem(MetadataMap):
         return self._metadata['url']
 
     def __lt__(self, other):
-        return str_time_to_unix_ts(self.created_at()) < str_time_to_unix_ts(other.created_at())
+        return self._created_ts < other._created_ts
 
     def __repr__(self):
         return 'GhArtifactItem(id={} name={} created_at={} expired={})'.format( \
             self.id(), self.name(), self.created_at(), self.expired())
 
+    def __str__(self):
+        return self.to_str()
+
 
 
 class GhArtifactList(MetadataMap):
@@ -236,12 +476,16 @@ class GhCommit(MetadataMap):
     def __repr__(self):
         return 'GhCommit({})'.format(self.hash())
 
+    def __str__(self):
+        return self.to_str()
+
 
 class GhCommitList(MetadataMap):
     """ List of GitHub commits """
 
-    def __init__(self, metadata):
+    def __init__(self, metadata, modified=True):
         super().__init__(metadata)
+        self._modified = modified
         self._commit_list = []
         for commit in metadata:
             self._commit_list.append(GhCommit(commit))
@@ -259,6 +503,10 @@ class GhCommitList(MetadataMap):
         """ Return a header to match the output of GhCommit.to_str() """
         return '{:>40}  {:>20}  {}'.format('commit hash', 'commit date/time', 'author')
 
+    def is_modified(self):
+        """ Return False if GitHub reported this list as unchanged since the previous request """
+        return self._modified
+
     def last_commit(self):
         """ Return last (most recent) commit, or None if no commits exist """
         if len(self._commit_list) > 0:
@@ -283,13 +531,14 @@ class GhRepository(MetadataMap):
         self._config = config
         self._name = name
         self._ap_flag = ap_flag
+        self._workflow_list = None # Last workflow list, returned again if not modified
 
-    def commit_list(self, since=None, per_page=50, page=0):
+    def commit_list(self, since=None, per_page=100, page=1):
         """ Get commit list """
         params = {'accept': 'application/vnd.github.v3+json', 'per_page': per_page, 'page': page}
         if since is not None:
             params['since'] = since
-        return GhCommitList(gh_http_get_request( \
+        return GhCommitList(*gh_http_conditional_get_request( \
             '{}/repos/{}/{}/commits'.format(self._config['GitHub']['service_url'],
                                             self._config[self._name]['source_repo_owner'],
                                             self._config[self._name]['source_repo_name']),
@@ -318,14 +567,16 @@ class GhRepository(MetadataMap):
         return 'Found repository {}:'.format(self.name())
 
     def workflow_list(self):
-        """ Get workflow list """
-        return GhWorkflowList( \
-            gh_http_get_request('{}/repos/{}/{}/actions/runs'.format( \
-                self._config['GitHub']['service_url'], self.owner(), self.name()),
-                                auth=self._config.auth(),
-                                params={'accept': 'application/vnd.github.v3+json',
-                                        'per_page': 50}),
-            self._config.auth())
+        """ Get workflow list. If GitHub reports that the list has not changed since the previous
+            call, the previous workflow list object is returned. """
+        metadata, modified = gh_http_conditional_get_request( \
+            '{}/repos/{}/{}/actions/runs'.format(self._config['GitHub']['service_url'],
+                                                 self.owner(), self.name()),
+            auth=self._config.auth(),
+            params={'accept': 'application/vnd.github.v3+json', 'per_page': 50})
+        if modified or self._workflow_list is None:
+            self._workflow_list = GhWorkflowList(metadata, self._config.auth())
+        return self._workflow_list
 
     @staticmethod
     def create_repository(config, name, ap_flag):
@@ -344,18 +595,32 @@ class GhRepository(MetadataMap):
     def __repr__(self):
         return 'GhRepository(full_name={})'.format(self.full_name())
 
+    def __str__(self):
+        return self.to_str()
+
 
 
 class GhWorkflowItem(MetadataMap):
     """ GitHub workflow item """
 
+    __slots__ = ('_artifact_list', '_auth', '_updated_ts')
+
     def __init__(self, metadata, auth):
         super().__init__(metadata)
-        self._artifact_list = GhArtifactList( \
-            gh_http_get_request(self._metadata['artifacts_url'],
-                                auth=auth,
-                                params={'accept': 'application/vnd.github.v3+json',
-                                        'per_page': 50}))
+        self._updated_ts = str_time_to_unix_ts(metadata['updated_at'])
+        self._auth = auth
+        self._artifact_list = None # Fetched on first use, see artifact_list()
+
+    def artifact_list(self):
+        """ Get the list of artifacts for this workflow. This is only requested from GitHub when
+            first needed, as workflows which are not completed and successful are not processed """
+        if self._artifact_list is None:
+            self._artifact_list = GhArtifactList( \
+                gh_http_get_request(self._metadata['artifacts_url'],
+                                    auth=self._auth,
+                                    params={'accept': 'application/vnd.github.v3+json',
+                                            'per_page': 50}))
+        return self._artifact_list
 
     def commit_id(self):
         """ Get head commit id """
@@ -372,14 +637,16 @@ class GhWorkflowItem(MetadataMap):
 
     def has_artifacts(self):
         """ Return True if workflow has completed sucessfully and has artifacts """
-        return self.status() == 'completed' and \
-            self.conclusion() == 'success' and \
-            len(self._artifact_list) > 0
+        return self.is_successful() and len(self.artifact_list()) > 0
 
     def html_url(self):
         """ Get HTML URL for this workflow """
         return self._metadata['html_url']
 
+    def is_successful(self):
+        """ Return True if workflow has completed successfully """
+        return self.status() == 'completed' and self.conclusion() == 'success'
+
     def run_number(self):
         """ Get build number """
         return self._metadata['run_number']
@@ -390,32 +657,34 @@ class GhWorkflowItem(MetadataMap):
 
     def to_str(self):
         """ Return a pretty string used in reporting """
-        num_artifacts = len(self._artifact_list)
-        if (self.status() != 'completed' or self.conclusion() != 'success') and num_artifacts == 0:
+        if not self.is_successful():
             return 'Run #{} updated {}: {}:{}'.format(self.run_number(), self.updated_at(),
                                                       self.status(), self.conclusion())
-        if num_artifacts == 0 or num_artifacts >= 2:
-            suffix = 's'
-        if self.has_artifacts():
+        num_artifacts = len(self.artifact_list())
+        suffix = '' if num_artifacts == 1 else 's'
+        if num_artifacts > 0:
             suffix = suffix + ':'
         return 'Run #{} updated {}: {}:{} containing {} artifact{}'.format( \
             self.run_number(), self.updated_at(), self.status(), self.conclusion(),
-            len(self._artifact_list), suffix)
+            num_artifacts, suffix)
 
     def updated_at(self):
         """ Get string timestamp of last update """
         return self._metadata['updated_at']
 
     def __iter__(self):
-        return sorted(self._artifact_list).__iter__()
+        return sorted(self.artifact_list()).__iter__()
 
     def __lt__(self, other):
-        return str_time_to_unix_ts(self.updated_at()) < str_time_to_unix_ts(other.updated_at())
+        return self._updated_ts < other._updated_ts
 
     def __repr__(self):
         return 'GhWorkflowItem(run_number={} dated {} status={} conclusion={})'.format( \
             self.run_number(), self.updated_at(), self.status(), self.conclusion())
 
+    def __str__(self):
+        return self.to_str()
+
 
 
 class GhWorkflowList(MetadataMap):
@@ -423,9 +692,9 @@ class GhWorkflowList(MetadataMap):
 
     def __init__(self, metadata, auth):
         super().__init__(metadata)
-        self._wf_item_list = []
-        for wf_item in self._metadata['workflow_runs']:
-            self._wf_item_list.append(GhWorkflowItem(wf_item, auth))
+        # Sorted once here, as the list is iterated several times for each poll
+        self._wf_item_list = sorted(GhWorkflowItem(wf_item, auth)
+                                    for wf_item in self._metadata['workflow_runs'])
 
     def to_str(self):
         """ Return a pretty string used in reporting """
@@ -433,10 +702,10 @@ class GhWorkflowList(MetadataMap):
 
     def wf_list(self):
         """ Get sorted list of workflow items """
-        return sorted(self._wf_item_list)
+        return self._wf_item_list
 
     def __iter__(self):
-        return sorted(self._wf_item_list).__iter__()
+        return self._wf_item_list.__iter__()
 
     def __len__(self):
         return len(self._wf_item_list)
@@ -445,4 +714,7 @@ class GhWorkflowList(MetadataMap):
         return 'GhWorkflowList(num_workflows={})'.format(len(self._wf_item_list))
 
     def __reversed__(self):
-        return reversed(sorted(self._wf_item_list))
+        return reversed(self._wf_item_list)
+
+    def __str__(self):
+        return self.to_str()
@@ -23,8 +23,11 @@ Common classes used by the various pollers.
 """
 
 import abc as _abc
+import json as _json
 import logging as _logging
-#import time as _time
+import os as _os
+import random as _random
+import time as _time
 
 import fortworth as _fortworth
 import wheedle.errors as _errors
@@ -32,26 +35,91 @@ import wheedle.gh_api as _gh_api
 
 
 
+# Upper limit of a random delay before the first poll, used to spread out poller wake-ups
+MAX_START_JITTER_SECS = 10
+
+# Upper limit of the error polling interval when it is backed off after consecutive errors
+MAX_ERROR_POLLING_INTERVAL_SECS = 30 * 60
+
+
+
+def write_json(file_name, data):
+    """ Write data to JSON file file_name atomically, so that neither another poller nor a restart
+        after a crash can see a partly written file """
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'w', encoding='utf-8') as temp_file:
+        temp_file.write(_json.dumps(data, indent=4, separators=(',', ': '), sort_keys=True))
+        temp_file.flush()
+        _os.fsync(temp_file.fileno())
+    _os.replace(temp_file_name, file_name)
+
+
+
 class Poller:
     """ Parent class for pollers that polls a GitHub repository for events or artifacts """
 
     def __init__(self, config, name, ap_event, ap_flag):
         self._config = config
         self._name = name
+        self._poller_section = config[name]
         self._ap_event = ap_event
+        self._consecutive_errors = 0
+        self._poll_changed = True # Set by poll(): False if nothing changed since the previous poll
+        self._idle_polling_interval = None # Polling interval after polls where nothing changed
+        self._session = _gh_api.SESSION
         self._repo = _gh_api.GhRepository.create_repository(config, name, ap_flag)
         self._log = _logging.getLogger('{}.{}'.format(self.__class__.__name__, name))
         if self._repo.is_disabled():
             raise _errors.DisabledRepoError(self._config.full_name())
         self._read_data()
         self._validate()
-
-    def start(self, sch=None):
-        """ Start poller """
-        next_polling_interval = self._polling_interval_secs(self.poll())
-        if sch is not None:
-            self._log.info('Waiting for next poll in %d secs...', next_polling_interval)
-            sch.enter(next_polling_interval, 1, self.start, (sch, ))
+        # The configuration does not change while running, so parse the polling intervals once. This
+        # also reports invalid values when the poller is created, rather than after its first poll.
+        self._polling_interval = self._polling_interval_secs(False)
+        self._error_polling_interval = self._polling_interval_secs(True)
+        self._max_polling_interval = self._max_polling_interval_secs()
+        self._start_delay = self._start_delay_secs()
+
+    def start(self):
+        """ Start poller, and poll at the polling interval until interrupted """
+        if self._start_delay is not None and self._start_delay > 0:
+            self._log.info('Waiting %d secs before first poll...', self._start_delay)
+            _time.sleep(self._start_delay)
+        # Start at a random offset, so that pollers with the same interval do not all wake together
+        _time.sleep(_random.uniform(0, MAX_START_JITTER_SECS))
+        while True:
+            poll_start = _time.monotonic()
+            next_polling_interval = self._next_polling_interval_secs(self.poll())
+            # The polling interval runs from the start of the poll, so that slow polls do not drift
+            # the polling schedule. The monotonic clock is not affected by system clock changes.
+            remaining_secs = max(0, next_polling_interval - (_time.monotonic() - poll_start))
+            self._log.info('Waiting for next poll in %d secs...', remaining_secs)
+            _time.sleep(remaining_secs)
+
+    def _next_polling_interval_secs(self, error_flag):
+        """ Return the time until the next poll, backing off exponentially with jitter on
+            consecutive errors. If a maximum polling interval is configured, the interval is also
+            doubled (up to that maximum) after each poll where nothing changed """
+        next_polling_interval = self._error_polling_interval if error_flag else \
+            self._polling_interval
+        if error_flag:
+            self._consecutive_errors += 1
+            next_polling_interval = min(next_polling_interval * 2 ** (self._consecutive_errors - 1),
+                                        MAX_ERROR_POLLING_INTERVAL_SECS)
+            next_polling_interval += _random.uniform(0, next_polling_interval * 0.1)
+            self._log.info('%d consecutive poll error(s)', self._consecutive_errors)
+        else:
+            self._consecutive_errors = 0
+            max_polling_interval = self._max_polling_interval
+            if self._poll_changed or max_polling_interval is None:
+                self._idle_polling_interval = None
+            else:
+                self._idle_polling_interval = min(2 * (next_polling_interval if
+                                                       self._idle_polling_interval is None else
+                                                       self._idle_polling_interval),
+                                                  max(max_polling_interval, next_polling_interval))
+                next_polling_interval = self._idle_polling_interval
+        return next_polling_interval
 
     def _raise_config_error(self, msg):
         raise _errors.ConfigFileError(self._config.config_file_name(), self._name, msg)
@@ -71,22 +139,19 @@ class Poller:
         return _fortworth.join(self._config.data_dir(),
                                'last_build_hash.{}.json'.format(self._name))
 
+    def _max_polling_interval_secs(self):
+        # Optional, may not be present in config
+        if 'max_polling_interval_secs' not in self._poller_config():
+            return None
+        try:
+            return int(self._poller_config()['max_polling_interval_secs'])
+        except ValueError:
+            self._raise_config_error('Invalid value "{}" for "max_polling_interval_secs"'.format( \
+                self._poller_config()['max_polling_interval_secs']))
+
     def _poller_config(self):
         """ Config for this poller """
-        return self._config[self._name]
-
-    # def _polling_interval_secs(self, error_flag):
-    #     if error_flag:
-    #         try:
-    #             return int(self._poller_config()['error_polling_interval_secs'])
-    #         except ValueError:
-    #             self._raise_config_error('Invalid value "{}" for "error_polling_interval_secs"'. \
-    #                 format(self._poller_config()['error_polling_interval_secs']))
-    #     try:
-    #         return int(self._poller_config()['polling_interval_secs'])
-    #     except ValueError:
-    #         self._raise_config_error('Invalid value "{}" for "polling_interval_secs"'.format( \
-    #             self._poller_config()['polling_interval_secs']))
+        return self._poller_section
 
     def _source_branch(self):
         return self._poller_config()['source_branch']
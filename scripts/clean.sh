@@ -21,4 +21,6 @@
 
 if [[ -n ${INSTALL_DIR} && -d ${INSTALL_DIR} ]]; then
 	rm -f ${INSTALL_DIR}/data/*.json
+	rm -f ${INSTALL_DIR}/data/etag-cache.sqlite
+	rm -rf ${INSTALL_DIR}/data/artifact-cache.*
 fi